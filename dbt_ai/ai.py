@@ -1,87 +1,382 @@
 # flake8: noqa
 
-import openai
+import io
+import json
 import os
-import requests
+import random
+import sys
+import textwrap
+import threading
+import time
+from types import ModuleType
+from typing import Callable, Final
 
+from dbt_ai.cache import cached_response, make_cache_key, response_cache
+from dbt_ai.helper import json_loads
+from dbt_ai.rate_limit import count_tokens, rate_limiter
 
-def generate_response(prompt) -> list:
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "user",
-                "content": """You are a helpful assistant that suggests only very basic improvements to dbt models based on the model content provided to you. Apply the rules outlined below. 
-                I will provide further questions and the contents of the dbt model in a following message. Do not deviate from the rules listed below \
-                Assume you are making suggestions to a very new data engineer who is new to dbt and maybe even SQL.
-                Your suggestions should help ensure this new engineer is most effectively using dbt
-                More rules: \
-                - Do not provide suggestions regarding capturing metadata in a yml file, because this information \
-                  is being provided as part of a separate check in this application \
-                - Do NOT suggest writing comments in models \
-                - Do NOT suggest using LIMIT if the model is already selecting a small number of records (e.g. under 1000) \
-                - Do NOT suggest using JOIN to filter records if the model is already selecting a small number of records (e.g. under 1000) \
-                - Do NOT suggest to consider adding a comment at the top of the model to explain the purpose of the query and any relevant context
-                - Avoid providing too many conditional suggestions such as "If this table is big, then do this"
-                - If you find or say that there are no  recommendations to provide, then do not proceed any further to provide anything else. Maybe add a compliment if it's nicely written!
-                - Limit to 4 suggestions maximum \
-                    \
-            Formatting: 
-            Suggestions for model `model_name`: \n\n
-                - suggestion 1 \n
-                - suggestion 2 \n
-                - suggestion 3 \n
-                """,
-            },
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=1024,
-        n=1,
-        stop=None,
-        temperature=0.1,
+CHAT_MODEL = "gpt-3.5-turbo"
+EMBEDDING_MODEL = "text-embedding-3-small"
+HTTP_POOL_SIZE = 32
+# (connect, read) timeouts in seconds, the read timeout applies between streamed chunks too
+REQUEST_TIMEOUT = (5, 60)
+MAX_ATTEMPTS = 5
+# Four suggestions of a sentence or two fit comfortably. The limit is reserved against the tokens per minute
+# budget before every request, so a tight limit lets more reviews run concurrently.
+MAX_SUGGESTION_TOKENS = 300
+
+
+_session_lock = threading.Lock()
+
+
+def _create_http_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    # By default the openai package creates a session per thread with a small connection pool. Sharing one
+    # keep-alive pool across all requests avoids repeating TCP and TLS handshakes for every model
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=2))
+    return session
+
+
+def _openai() -> ModuleType:
+    """The openai package, imported on first use. It takes longer to import than the rest of the application,
+    and runs where every response is cached never need it."""
+    # Looked up through this module's globals, so patching dbt_ai.ai.openai replaces it for every request
+    module = globals().get("openai")
+    if module is not None:
+        return module
+
+    import openai
+
+    with _session_lock:
+        if openai.requestssession is None:
+            openai.requestssession = _create_http_session()
+    globals()["openai"] = openai
+    return openai
+
+
+def __getattr__(name: str):
+    # Imports openai the first time dbt_ai.ai.openai is accessed, e.g. to patch it
+    if name == "openai":
+        return _openai()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _call_openai(create: Callable, tokens: int):
+    """Make an OpenAI request within the rate limits, backing off exponentially when it is throttled anyway"""
+    openai = _openai()
+    for attempt in range(MAX_ATTEMPTS):
+        rate_limiter.acquire(tokens)
+        try:
+            return create()
+        except (openai.error.RateLimitError, openai.error.ServiceUnavailableError) as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = min(60, 2**attempt) + random.random()
+            print(f"OpenAI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def chat_cache_key(messages: list[dict], temperature: float, max_tokens: int, model: str = CHAT_MODEL) -> str:
+    # The full request payload (model, messages, sampling settings) makes up the cache key, so any change to
+    # the model SQL or to the prompt templates invalidates previously cached responses
+    return make_cache_key("chat_completion", model, messages, temperature, max_tokens)
+
+
+def _request_chat_completion(
+    messages: list[dict],
+    temperature: float,
+    max_tokens: int,
+    model: str,
+    stream: bool,
+    response_format: dict | None,
+) -> tuple[str, str | None]:
+    """Request a chat completion, returning its content and the reason the model stopped generating"""
+    # max_tokens counts towards the tokens per minute limit as well as the prompt
+    response = _call_openai(
+        lambda: _openai().ChatCompletion.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            n=1,
+            stop=None,
+            temperature=temperature,
+            stream=stream,
+            request_timeout=REQUEST_TIMEOUT,
+            **({"response_format": response_format} if response_format else {}),
+        ),
+        tokens=count_tokens(messages, model) + max_tokens,
     )
-    return response.choices[0].message["content"].strip()
 
+    if stream:
+        # Print tokens as they arrive so the first suggestions show up without waiting for the full response
+        chunks = []
+        finish_reason = None
+        for chunk in response:
+            choice = chunk.choices[0]
+            delta = choice.delta.get("content", "")
+            chunks.append(delta)
+            sys.stdout.write(delta)
+            sys.stdout.flush()
+            # Only the last chunk has a finish reason
+            finish_reason = getattr(choice, "finish_reason", None) or finish_reason
+        sys.stdout.write("\n")
+        return "".join(chunks).strip(), finish_reason
+
+    choice = response.choices[0]
+    return choice.message["content"].strip(), getattr(choice, "finish_reason", None)
+
+
+def _chat_completion(
+    messages: list[dict],
+    temperature: float,
+    max_tokens: int,
+    model: str = CHAT_MODEL,
+    stream: bool = False,
+    response_format: dict | None = None,
+) -> str:
+    key = chat_cache_key(messages, temperature, max_tokens, model)
+    content = response_cache.get(key)
+    if content is not None:
+        if stream:
+            print(content)
+        return content
+
+    content, finish_reason = _request_chat_completion(messages, temperature, max_tokens, model, stream, response_format)
+    if finish_reason == "length" and not stream:
+        # The response was cut off, ask again with room for a longer answer. Streamed responses have already
+        # been printed, so they are not requested twice
+        content, finish_reason = _request_chat_completion(
+            messages, temperature, max_tokens * 2, model, stream, response_format
+        )
 
-def generate_response_advanced(prompt) -> list:
-    example_advanced_recommendations = """
-        - Consider using a window function to calculate rolling averages or cumulative sums for a large dataset. This can improve query performance by reducing the need to perform multiple passes over the same data.
-        - If a model contains a large number of columns, consider splitting it into multiple models to improve query performance and maintainability.
-        - Consider using a common table expression (CTE) to break down a complex query into smaller, more manageable pieces. This can improve query readability and maintainability.
-        - If a model contains a large amount of data, consider using a partitioning key to improve query performance. This can help distribute the data across multiple nodes and reduce the amount of data that needs to be scanned.
-        - Consider using a temporary table to store intermediate results for a complex query. This can help simplify the query logic and improve query performance by reducing the need to repeat certain calculations.
-        - If a model contains a large number of joins, consider using a star schema or a snowflake schema to simplify the data model and improve query performance.
+    if finish_reason == "length":
+        # Caching a truncated response would serve the partial suggestions on every later run
+        print(f"Warning: the response for {model} was cut off at the token limit, so it was not cached")
+        return content
+
+    response_cache.set(key, content)
+    return content
+
+
+# The instructions are identical for every model so they form a stable prefix that OpenAI can cache
+# across requests. Anything model specific must only be sent in the final user message. The prompts are
+# dedented and stripped once here, so their exact bytes don't depend on how this file is indented.
+BASIC_SYSTEM_PROMPT: Final[str] = textwrap.dedent(
     """
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "user",
-                "content": f"""You are a helpful assistant that suggests only very advanced improvements to dbt models based on the model content provided to you. Apply the rules outlined below. 
-                I will provide further questions and the contents of the dbt model in a following message. Do not deviate from the rules listed below \
-                Assume you are making suggestions to a highly skilled data engineer with strong knowledge of dbt and SQL.  \
-                More rules: \
-                - Avoid providing too many conditional suggestions such as "If this table is big, then do this"
-                - If you find or say that there are no advanced recommendations to provide, then do not proceed any further to provide non-advanced recommendations. Maybe add a compliment if it's nicely written!
-                - Limit to 4 suggestions maximum 
-                - Here are a number of example recommendations that can be classified as advanced. Your recommendations should classify equally as advanced as these recommendations (but do not need to be the same):
-                    {example_advanced_recommendations}
-                    
-            Formatting: 
-            Suggestions for model `model_name`: \n\n
-                - suggestion 1 \n
-                - suggestion 2 \n
-                - suggestion 3 \n
-                """,
-            },
+    You are a helpful assistant that suggests only very basic improvements to dbt models based on the model content provided to you. Apply the rules outlined below.
+    I will provide the database system, the model name and the contents of the dbt model in a following message.
+    Please provide suggestions on how to improve this model in terms of syntax, code structure and dbt best practices such as using ref instead of hardcoding table names. The suggestion should be specific to dbt models written in the given database system. Do not deviate from the rules listed below.
+    Assume you are making suggestions to a very new data engineer who is new to dbt and maybe even SQL.
+    Your suggestions should help ensure this new engineer is most effectively using dbt.
+    More rules:
+    - Do not provide suggestions regarding capturing metadata in a yml file, because this information is being provided as part of a separate check in this application
+    - Do NOT suggest writing comments in models
+    - Do NOT suggest using LIMIT if the model is already selecting a small number of records (e.g. under 1000)
+    - Do NOT suggest using JOIN to filter records if the model is already selecting a small number of records (e.g. under 1000)
+    - Do NOT suggest to consider adding a comment at the top of the model to explain the purpose of the query and any relevant context
+    - Avoid providing too many conditional suggestions such as "If this table is big, then do this"
+    - If you find or say that there are no recommendations to provide, then do not proceed any further to provide anything else. Maybe add a compliment if it's nicely written!
+    - Limit to 4 suggestions maximum
+    """
+).strip()
+
+EXAMPLE_ADVANCED_RECOMMENDATIONS: Final[str] = textwrap.dedent(
+    """
+    - Consider using a window function to calculate rolling averages or cumulative sums for a large dataset. This can improve query performance by reducing the need to perform multiple passes over the same data.
+    - If a model contains a large number of columns, consider splitting it into multiple models to improve query performance and maintainability.
+    - Consider using a common table expression (CTE) to break down a complex query into smaller, more manageable pieces. This can improve query readability and maintainability.
+    - If a model contains a large amount of data, consider using a partitioning key to improve query performance. This can help distribute the data across multiple nodes and reduce the amount of data that needs to be scanned.
+    - Consider using a temporary table to store intermediate results for a complex query. This can help simplify the query logic and improve query performance by reducing the need to repeat certain calculations.
+    - If a model contains a large number of joins, consider using a star schema or a snowflake schema to simplify the data model and improve query performance.
+    """
+).strip()
+
+ADVANCED_SYSTEM_PROMPT: Final[str] = (
+    textwrap.dedent(
+        """
+    You are a helpful assistant that suggests only very advanced improvements to dbt models based on the model content provided to you. Apply the rules outlined below.
+    I will provide the database system, the model name and the contents of the dbt model in a following message.
+    Please provide advanced suggestions on how to improve this model. The suggestion should be specific to dbt models written in the given database system.
+    If there are no advanced recommendations to provide, then do not provide anything. If you are lacking context required to provide any advanced recommendations then don't provide anything.
+    Example of an advanced recommendation include suggesting Snowflake partitioning keys when you see table names being used that are very likely to be large tables e.g. invoice or journal line tables. Note that is just one example. Do not deviate from the rules listed below.
+    Assume you are making suggestions to a highly skilled data engineer with strong knowledge of dbt and SQL.
+    More rules:
+    - Avoid providing too many conditional suggestions such as "If this table is big, then do this"
+    - If you find or say that there are no advanced recommendations to provide, then do not proceed any further to provide non-advanced recommendations. Maybe add a compliment if it's nicely written!
+    - Limit to 4 suggestions maximum
+    - Here are a number of example recommendations that can be classified as advanced. Your recommendations should classify equally as advanced as these recommendations (but do not need to be the same):
+    """
+    ).strip()
+    + "\n"
+    + EXAMPLE_ADVANCED_RECOMMENDATIONS
+)
+
+RESPONSE_FORMAT: Final[str] = textwrap.dedent(
+    """
+    Formatting:
+    Suggestions for model `model_name`:
+
+    - suggestion 1
+    - suggestion 2
+    - suggestion 3
+
+    Keep each suggestion to one or two sentences.
+    """
+).strip()
+
+BATCH_RESPONSE_FORMAT: Final[str] = textwrap.dedent(
+    """
+    Instead of a single model, the following message contains a JSON object with the database system and a list of dbt models, each with a model_name and its sql. Apply the rules above to each model independently.
+    Formatting: respond only with JSON, containing one review for every model provided:
+    {"reviews": [{"model_name": "model_name", "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"]}]}
+    Keep each suggestion to one or two sentences.
+    """
+).strip()
+
+
+def build_chat_request(prompt: str, advanced: bool = False) -> dict:
+    """Chat completion parameters for reviewing a single model, shared by direct and Batch API requests"""
+    system_prompt = ADVANCED_SYSTEM_PROMPT if advanced else BASIC_SYSTEM_PROMPT
+    return {
+        "model": CHAT_MODEL,
+        "messages": [
+            {"role": "system", "content": f"{system_prompt}\n\n{RESPONSE_FORMAT}"},
             {"role": "user", "content": prompt},
         ],
-        max_tokens=1024,
-        n=1,
-        stop=None,
-        temperature=0,
+        "temperature": 0 if advanced else 0.1,
+        "max_tokens": MAX_SUGGESTION_TOKENS,
+    }
+
+
+def prompt_version(advanced: bool = False) -> str:
+    """Short hash of a review request without the model, which changes whenever the prompts or settings do"""
+    return make_cache_key(build_chat_request("", advanced))[:12]
+
+
+def generate_response(prompt, stream: bool = False) -> str:
+    return _chat_completion(**build_chat_request(prompt), stream=stream)
+
+
+def generate_response_advanced(prompt, stream: bool = False) -> str:
+    return _chat_completion(**build_chat_request(prompt, advanced=True), stream=stream)
+
+
+def generate_response_batch(models: list[dict], database: str, advanced: bool = False) -> dict[str, str]:
+    """Review several models in a single request, returning the suggestions keyed by model name"""
+    system_prompt = ADVANCED_SYSTEM_PROMPT if advanced else BASIC_SYSTEM_PROMPT
+    content = _chat_completion(
+        messages=[
+            {"role": "system", "content": f"{system_prompt}\n\n{BATCH_RESPONSE_FORMAT}"},
+            {"role": "user", "content": json.dumps({"database_system": database, "models": models}, sort_keys=True)},
+        ],
+        temperature=0 if advanced else 0.1,
+        max_tokens=min(4096, MAX_SUGGESTION_TOKENS * len(models)),
+        # JSON mode guarantees the reply parses, so a whole batch isn't lost to a stray sentence around the JSON
+        response_format={"type": "json_object"},
+    )
+
+    try:
+        reviews = parse_batch_reviews(content)
+    except ValueError as e:
+        print(f"Error parsing batched suggestions: {e}")
+        return {}
+
+    suggestions = {}
+    for model_name, model_suggestions in reviews.items():
+        bullets = "\n".join(f"- {suggestion}" for suggestion in model_suggestions)
+        suggestions[model_name] = f"Suggestions for model `{model_name}`:\n\n{bullets}"
+    return suggestions
+
+
+def parse_batch_reviews(content: str) -> dict[str, list[str]]:
+    """Parse and validate a {"reviews": [{"model_name": str, "suggestions": [str]}]} response in a single pass"""
+    parsed = json_loads(content)
+    reviews = parsed.get("reviews") if isinstance(parsed, dict) else None
+    if not isinstance(reviews, list):
+        raise ValueError("response does not contain a list of reviews")
+
+    validated = {}
+    for review in reviews:
+        if not isinstance(review, dict) or not isinstance(review.get("model_name"), str):
+            continue
+        model_suggestions = review.get("suggestions")
+        if not isinstance(model_suggestions, list):
+            continue
+        validated[review["model_name"]] = [str(suggestion) for suggestion in model_suggestions]
+    return validated
+
+
+def run_batch(chat_requests: dict[str, dict], poll_interval: int = 30) -> dict[str, str]:
+    """Run chat completion requests through the OpenAI Batch API, returning the responses keyed by request id.
+
+    Batches are billed at half the price of regular requests but can take up to 24 hours to complete.
+    """
+    results = {}
+    pending = {}
+    for custom_id, body in chat_requests.items():
+        cached = response_cache.get(chat_cache_key(**body))
+        if cached is not None:
+            results[custom_id] = cached
+        else:
+            pending[custom_id] = body
+
+    if not pending:
+        return results
+
+    batch_input = "\n".join(
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+        for custom_id, body in pending.items()
+    )
+    openai = _openai()
+    from openai import api_requestor
+
+    input_file = openai.File.create(
+        file=io.BytesIO(batch_input.encode("utf-8")), purpose="batch", user_provided_filename="dbt_ai_batch.jsonl"
+    )
+
+    requestor = api_requestor.APIRequestor()
+    response, _, _ = requestor.request(
+        "post",
+        "/batches",
+        {"input_file_id": input_file.id, "endpoint": "/v1/chat/completions", "completion_window": "24h"},
+    )
+    batch = response.data
+    print(f"Submitted batch {batch['id']} containing {len(pending)} requests, waiting for it to complete")
+
+    while batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        response, _, _ = requestor.request("get", f"/batches/{batch['id']}")
+        batch = response.data
+
+    if batch["status"] != "completed" or not batch.get("output_file_id"):
+        print(f"Batch {batch['id']} finished with status {batch['status']}")
+        return results
+
+    output = openai.File.download(batch["output_file_id"]).decode("utf-8")
+    for line in output.splitlines():
+        result = json_loads(line)
+        response_body = (result.get("response") or {}).get("body") or {}
+        if not response_body.get("choices"):
+            print(f"Batch request {result['custom_id']} failed: {result.get('error')}")
+            continue
+
+        content = response_body["choices"][0]["message"]["content"].strip()
+        response_cache.set(chat_cache_key(**pending[result["custom_id"]]), content)
+        results[result["custom_id"]] = content
+
+    return results
+
+
+@cached_response
+def generate_embedding(text: str, model: str = EMBEDDING_MODEL) -> list[float]:
+    response = _call_openai(
+        lambda: _openai().Embedding.create(model=model, input=text),
+        tokens=count_tokens([{"content": text}], model),
     )
-    return response.choices[0].message["content"].strip()
+    return response["data"][0]["embedding"]
 
 
 def generate_dalle_image(prompt: str, image_size: str = "1024x1024"):
@@ -89,14 +384,14 @@ def generate_dalle_image(prompt: str, image_size: str = "1024x1024"):
                     {prompt} \
                     "
     print(f"Generating AI image using DALL-E with the following prompt: {final_prompt}")
-    response = openai.Image.create(
+    response = _openai().Image.create(
         prompt=prompt,
         n=1,
         size=image_size,
     )
 
     image_url = response.data[0].url.strip()
-    image_binary = requests.get(image_url).content
+    image_binary = _openai().requestssession.get(image_url).content
 
     return image_binary
 
@@ -106,7 +401,7 @@ def generate_models(prompt: str, sources_yml: str) -> list[str]:
     prompt_with_sources = f"{prompt}\n\nSources YAML:\n\n{sources_yml}\n\n"
     output_dir = "models"
     # Generate response using OpenAI API
-    response = openai.ChatCompletion.create(
+    response = _openai().ChatCompletion.create(
         model="gpt-3.5-turbo",
         messages=[
             {
@@ -0,0 +1,153 @@
+# flake8: noqa
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+from dbt_ai.helper import json_dumps, json_loads
+
+if TYPE_CHECKING:
+    import numpy as np
+
+CACHE_DIR = os.getenv("DBT_AI_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dbt-ai"))
+DEFAULT_TTL = 86400
+
+
+def make_cache_key(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """On-disk cache of AI responses, one JSON file per key"""
+
+    def __init__(self, cache_dir: str, ttl: int = DEFAULT_TTL) -> None:
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        # A missing, unreadable or corrupt entry is a cache miss, the cache must never stop a review
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = json_loads(f.read())
+            if time.time() - entry["created"] > self.ttl:
+                return None
+            return entry["value"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def set(self, key: str, value) -> None:
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(json_dumps({"created": time.time(), "value": value}))
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Warning: could not write to the response cache in {self.cache_dir}: {e}")
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of AI responses, matched on the embedding of the model SQL. Entries are appended
+    to a JSON lines file as they are added, rather than rewriting the whole file each time."""
+
+    def __init__(self, path: str, threshold: float = 0.95, ttl: int = DEFAULT_TTL) -> None:
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Optional[list[dict]] = None
+        self._matrix: Optional[np.ndarray] = None
+
+    def _load(self) -> list[dict]:
+        if self._entries is None:
+            entries = []
+            now = time.time()
+            try:
+                with open(self.path, "rb") as f:
+                    for line in f:
+                        # A line left incomplete by an interrupted run, or in an unexpected shape, is skipped
+                        try:
+                            entry = json_loads(line)
+                            if now - entry["created"] <= self.ttl:
+                                entries.append(entry)
+                        except (ValueError, KeyError, TypeError):
+                            continue
+            except OSError:
+                pass
+            self._entries = entries
+            self._matrix = None
+        return self._entries
+
+    def _normalised_matrix(self) -> np.ndarray:
+        import numpy as np
+
+        matrix = self._matrix
+        if matrix is None:
+            matrix = np.array([entry["embedding"] for entry in self._load()], dtype=np.float32)
+            matrix = self._matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix
+
+    def lookup(self, embedding: list[float]) -> Optional[dict]:
+        with self._lock:
+            entries = self._load()
+            if not entries:
+                return None
+
+            import numpy as np
+
+            query = np.asarray(embedding, dtype=np.float32)
+            similarities = self._normalised_matrix() @ (query / np.linalg.norm(query))
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            return entries[best]
+
+    def add(self, embedding: list[float], model_name: str, response: str) -> None:
+        entry = {"created": time.time(), "embedding": embedding, "model_name": model_name, "response": response}
+        with self._lock:
+            self._load().append(entry)
+            self._matrix = None
+
+            # Only the new entry is written, so each add costs the same however large the cache has grown
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(json_dumps(entry) + b"\n")
+            except OSError as e:
+                print(f"Warning: could not write to the semantic cache {self.path}: {e}")
+
+
+response_cache = ResponseCache(os.path.join(CACHE_DIR, "responses"))
+
+
+def cached_response(func: Callable) -> Callable:
+    """Cache the return value of an AI call, keyed on the function name and all of its arguments"""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Bind with defaults applied so that omitted arguments (e.g. the model name) still form part of the key
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = make_cache_key(func.__name__, bound.arguments)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
+
+        response = func(*args, **kwargs)
+        response_cache.set(key, response)
+        return response
+
+    return wrapper
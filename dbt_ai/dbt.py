@@ -1,30 +1,196 @@
 # flake8: noqa
 
-import glob
+from __future__ import annotations
+
+import hashlib
 import os
 import re
-from typing import Callable
+import shutil
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path, PurePath
+from typing import TYPE_CHECKING, Callable, Iterator
 
-import networkx as nx
-import plotly.graph_objects as go
 import yaml
 
-from dbt_ai.ai import generate_dalle_image, generate_models, generate_response, generate_response_advanced
-from dbt_ai.helper import find_yaml_files
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml, fall back to the pure Python loader
+    from yaml import SafeLoader
+
+from dbt_ai.ai import (
+    build_chat_request,
+    generate_dalle_image,
+    generate_embedding,
+    generate_models,
+    generate_response,
+    generate_response_advanced,
+    generate_response_batch,
+    prompt_version,
+    run_batch,
+)
+from dbt_ai.cache import CACHE_DIR, SemanticCache
+from dbt_ai.helper import extract_refs, find_model_files, find_yaml_files, rename_model
+
+if TYPE_CHECKING:
+    # networkx, numpy and plotly take a noticeable part of start up time, so they are only imported when needed
+    import networkx as nx
+
+# Generated models are separated by a line containing only ===
+_MODEL_DELIMITER_RE = re.compile(r"(?m)^===\s*")
+# Models are reviewed concurrently since each review is spent waiting on OpenAI, the rate limiter keeps the
+# combined request rate within the account limits
+MAX_WORKERS = 8
+
+
+def _scan_model_names(stream) -> list[str]:
+    """Names of the models declared under `models:` in a YAML document, read from the parser's event stream
+    rather than constructing the whole document"""
+    names = []
+    # One frame per open mapping or sequence: [is_mapping, expecting_key, last_key, is_key]
+    frames = []
+
+    def value_done():
+        if frames and frames[-1][0]:
+            frames[-1][1] = True
+
+    for event in yaml.parse(stream, Loader=SafeLoader):
+        if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+            # A collection can also be used as a mapping key, although it can never be a `name` key
+            is_key = bool(frames and frames[-1][0] and frames[-1][1])
+            if is_key:
+                frames[-1][1], frames[-1][2] = False, None
+            frames.append([isinstance(event, yaml.MappingStartEvent), True, None, is_key])
+        elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+            if not frames.pop()[3]:
+                value_done()
+        elif isinstance(event, (yaml.ScalarEvent, yaml.AliasEvent)):
+            if frames and frames[-1][0] and frames[-1][1]:
+                frames[-1][1] = False
+                frames[-1][2] = event.value if isinstance(event, yaml.ScalarEvent) else None
+                continue
+
+            # Only the value of `name` in a mapping directly inside the top level `models` sequence is a model
+            if (
+                isinstance(event, yaml.ScalarEvent)
+                and len(frames) == 3
+                and frames[0][0]
+                and frames[0][2] == "models"
+                and not frames[1][0]
+                and frames[2][0]
+                and frames[2][2] == "name"
+            ):
+                names.append(event.value)
+            value_done()
+        elif isinstance(event, yaml.DocumentStartEvent):
+            frames.clear()
+
+    return names
+
+
+def _spring_layout(gph: nx.DiGraph, seed: int = 42, iterations: int = 50) -> dict:
+    """Fruchterman-Reingold force directed layout, computing the forces between all nodes as numpy array operations.
+
+    networkx.spring_layout needs scipy for graphs of 500 or more nodes, which isn't a dependency of this package."""
+    import numpy as np
+
+    nodes = list(gph.nodes())
+    if len(nodes) < 2:
+        return {node: np.zeros(2) for node in nodes}
+
+    index = {node: i for i, node in enumerate(nodes)}
+    adjacency = np.zeros((len(nodes), len(nodes)))
+    for source, target in gph.edges():
+        adjacency[index[source], index[target]] = adjacency[index[target], index[source]] = 1
+
+    pos = np.random.default_rng(seed).random((len(nodes), 2))
+    k = np.sqrt(1 / len(nodes))
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        squared = (pos**2).sum(axis=1)
+        distance = np.sqrt(np.maximum(squared[:, np.newaxis] + squared[np.newaxis, :] - 2 * pos @ pos.T, 1e-4))
+        # Every pair of nodes repels, nodes joined by an edge also attract. The force on node i is the sum of
+        # force[i, j] * (pos[i] - pos[j]), which expands to a single matrix product
+        force = k * k / distance**2 - adjacency * distance / k
+        displacement = pos * force.sum(axis=1)[:, np.newaxis] - force @ pos
+        length = np.linalg.norm(displacement, axis=-1)
+        length = np.where(length < 0.01, 0.1, length)
+        pos += displacement * (temperature / length)[:, np.newaxis]
+        temperature -= cooling
+
+    pos -= pos.mean(axis=0)
+    pos /= np.abs(pos).max() or 1
+    return dict(zip(nodes, pos))
+
+
+@dataclass(slots=True)
+class ModelResult:
+    """A processed model, which still supports model["field"] lookups like the dicts it replaces"""
+
+    model_name: str
+    metadata_exists: bool
+    suggestions: str | list[str] = ""
+    refs: list[str] = field(default_factory=list)
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
 
 
 class DbtModelProcessor:
     """Class containing functions to process and analyse a DBT project"""
 
-    def __init__(self, dbt_project_path: str, database: str = "snowflake") -> None:
+    def __init__(
+        self, dbt_project_path: str, database: str = "snowflake", semantic_cache: bool = False, stream: bool = False
+    ) -> None:
         self.dbt_project_path = dbt_project_path
-        self.yaml_files = find_yaml_files(dbt_project_path)
         self.api_key_available = bool(os.getenv("OPENAI_API_KEY"))
         self.sources_yml_content = self.read_sources_yml(dbt_project_path)
         self.database = database
+        self.stream = stream
+        self._suggestions_by_content: dict[tuple, Future] = {}
+        self._suggestions_lock = threading.Lock()
+        # Sort orders and layouts of lineage graphs already computed, keyed by lineage_key
+        self._topological_orders: dict[tuple, list[str]] = {}
+        self._layouts: dict[tuple, dict] = {}
+        # Pending read of the documented models, when it runs alongside the directory walk
+        self._metadata_scan: Future | None = None
+        self.semantic_caches = (
+            {
+                advanced: SemanticCache(
+                    # Suggestions generated with an earlier version of the prompts are kept apart from current ones
+                    os.path.join(
+                        CACHE_DIR,
+                        "semantic",
+                        f"{'advanced' if advanced else 'basic'}_{database}_{prompt_version(advanced)}.jsonl",
+                    )
+                )
+                for advanced in (False, True)
+            }
+            if semantic_cache
+            else None
+        )
         if not self.api_key_available:
             print("Warning: OPENAI_API_KEY is not set. Suggestion features will be unavailable.")
 
+    @cached_property
+    def yaml_files(self) -> list[str]:
+        return find_yaml_files(self.dbt_project_path)
+
+    @cached_property
+    def documented_models(self) -> frozenset[str]:
+        # Only read the project's YAML files once something needs them, creating models never does
+        if self._metadata_scan is not None:
+            return self._metadata_scan.result()
+        return self.read_documented_models()
+
     def read_sources_yml(self, dbt_project_path: str):
         sources_yml_path = os.path.join(dbt_project_path, "models", "sources.yml")
         try:
@@ -35,171 +201,374 @@ class DbtModelProcessor:
             sources_yml_content = None
         return sources_yml_content
 
-    def get_model_refs(self, model_file_path: str) -> list:
-        with open(model_file_path, "r") as f:
-            content = f.read()
+    def read_sql(self, model_file: str) -> str:
+        with open(model_file, "r") as f:
+            return f.read()
 
-        refs = re.findall(r"ref\(['\"]([\w\.]+)['\"]\)", content)
+    def get_model_refs(self, content: str) -> list:
+        refs = extract_refs(content)
 
         return refs
 
-    def suggest_dbt_model_improvements(self, file_path: str, model_name: str) -> list:
-        with open(file_path, "r") as f:
-            content = f.read()
-        prompt = f"""Given the following dbt model {model_name}:\n\n{content}\n\nPlease provide suggestions on how to improve this model in terms of syntax, code structure and dbt best practices \
-            such as using ref instead of hardcoding table names. The suggestion should be specific to db models written in the {self.database} database system: \
-            """
-        response = generate_response(prompt)
+    def build_model_prompt(self, content: str, model_name: str) -> str:
+        # Only the per-model details go here, the instructions live in the static system prompt
+        return f"Database system: {self.database}\nModel name: {model_name}\n\n{content}"
+
+    def suggest_dbt_model_improvements(self, content: str, model_name: str) -> str:
+        response = generate_response(self.build_model_prompt(content, model_name), stream=self.stream)
         return response
 
-    def suggest_dbt_model_improvements_advanced(self, file_path: str, model_name: str) -> list:
-        with open(file_path, "r") as f:
-            content = f.read()
-        prompt = f"""Given the following dbt model {model_name}:\n\n{content}\n\n \
-            Please provide advanced suggestions on how to improve this model.
-            The suggestion should be specific to dbt models written in the {self.database} database system 
-            If there are no advanced recommendations to provide, then do not provide anything. If you are lacking context required to provide any advanced
-            recommendations then don't provide anything. Example of an advanced recommendation include suggesting Snowflake partitioning keys when you see table names 
-            being used that are very likely to be large tables e.g. invoice or journal line tables. Note that is just one example.
-                """
-        response = generate_response_advanced(prompt)
+    def suggest_dbt_model_improvements_advanced(self, content: str, model_name: str) -> str:
+        response = generate_response_advanced(self.build_model_prompt(content, model_name), stream=self.stream)
         return response
 
-    def process_model(self, model_file: str, advanced: bool = False):
-        model_name = os.path.basename(model_file).replace(".sql", "")
+    def suggest_dbt_model_improvements_batch(self, models: list[dict], advanced: bool = False) -> dict[str, str]:
+        return generate_response_batch(models, self.database, advanced)
+
+    def get_suggestions(self, content: str, model_name: str, advanced: bool = False) -> str:
+        # Models generated from the same macro or template often have identical SQL, only request suggestions
+        # for the first one and reuse them for the rest
+        content_hash = (hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest(), advanced)
+        with self._suggestions_lock:
+            future = self._suggestions_by_content.get(content_hash)
+            is_first = future is None
+            if is_first:
+                future = self._suggestions_by_content[content_hash] = Future()
+
+        if not is_first:
+            # Wait for the thread requesting suggestions for the same SQL, rather than requesting them again
+            original_model_name, response = future.result()
+            return rename_model(response, original_model_name, model_name)
+
+        try:
+            response = self._request_suggestions(content, model_name, advanced)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result((model_name, response))
+        return response
+
+    def _request_suggestions(self, content: str, model_name: str, advanced: bool = False) -> str:
+        suggest = self.suggest_dbt_model_improvements_advanced if advanced else self.suggest_dbt_model_improvements
+        if not self.semantic_caches:
+            return suggest(content, model_name)
+
+        # Models that only differ by whitespace, aliases or column order embed almost identically,
+        # so the suggestions made for the closest previously seen model can be reused
+        embedding = generate_embedding(content)
+        semantic_cache = self.semantic_caches[advanced]
+        match = semantic_cache.lookup(embedding)
+        if match:
+            return rename_model(match["response"], match["model_name"], model_name)
+
+        response = suggest(content, model_name)
+        semantic_cache.add(embedding, model_name, response)
+        return response
+
+    def process_model(
+        self, model_file: str, advanced: bool = False, model_name: str | None = None, metadata_only: bool = False
+    ) -> ModelResult:
+        if model_name is None:
+            # Interned like the names found in refs, so they share one object with every ref to this model
+            model_name = sys.intern(PurePath(model_file).stem)
+        if metadata_only:
+            # Only the model's name is needed to check its metadata, so the SQL file isn't even opened
+            return ModelResult(model_name, self.model_has_metadata(model_name))
+
+        # Read the model once and share the content between the suggestion and ref lookups
+        content = self.read_sql(model_file)
 
-        has_metadata = self.model_has_metadata(model_name)
         if self.api_key_available:
-            if advanced:
-                raw_suggestion = self.suggest_dbt_model_improvements_advanced(model_file, model_name)
-            else:
-                raw_suggestion = self.suggest_dbt_model_improvements(model_file, model_name)
+            raw_suggestion = self.get_suggestions(content, model_name, advanced)
         else:
             raw_suggestion = ""
 
-        refs = self.get_model_refs(model_file)
+        # Checked after the review, so the review doesn't wait on a metadata scan that is still running
+        has_metadata = self.model_has_metadata(model_name)
+
+        refs = self.get_model_refs(content)
+
+        return ModelResult(model_name, has_metadata, raw_suggestion, refs)
+
+    def iter_processed_models(
+        self, advanced: bool = False, max_workers: int = MAX_WORKERS, metadata_only: bool = False
+    ) -> Iterator[ModelResult]:
+        """Yield each processed model in directory order, as soon as it and the models before it are done"""
+        if metadata_only:
+            # Nothing is read or requested for each model, so there is no waiting to spread over worker threads
+            for model_file, model_name in find_model_files(self.dbt_project_path):
+                yield self.process_model(model_file, model_name=model_name, metadata_only=True)
+            return
+
+        # Streamed suggestions from several models at once would be interleaved in the terminal
+        max_workers = 1 if self.stream else max_workers
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Read the YAML files in a worker while the SQL files are being found, rather than one after the other.
+            # Every worker then waits on this one scan, instead of each reading the YAML files itself
+            if "documented_models" not in self.__dict__:
+                self._metadata_scan = executor.submit(self.read_documented_models)
+            # Each model is submitted as soon as the directory walk finds it, so the first reviews are already
+            # running while the rest of a large project is still being discovered
+            futures = deque(
+                # The directory walk already has each model's name, pass it on rather than parse it from the path again
+                executor.submit(self.process_model, model_file, advanced, model_name)
+                for model_file, model_name in find_model_files(self.dbt_project_path)
+            )
+            try:
+                # Drop each future once its model has been yielded, so finished results aren't all held until the end
+                while futures:
+                    yield futures.popleft().result()
+            finally:
+                # When the caller stops early (a closed pipe, Ctrl-C) the reviews that haven't started are never made
+                for future in futures:
+                    future.cancel()
+
+    def process_dbt_models(
+        self, advanced: bool = False, max_workers: int = MAX_WORKERS, metadata_only: bool = False
+    ) -> tuple[list[ModelResult], list[str]]:
+        models = []
+        missing_metadata = []
+        # Collect the results and check for models without metadata in the same pass
+        for model in self.iter_processed_models(advanced, max_workers, metadata_only):
+            models.append(model)
+            if not model.metadata_exists:
+                missing_metadata.append(model.model_name)
 
-        return {
-            "model_name": model_name,
-            "metadata_exists": has_metadata,
-            "suggestions": raw_suggestion,
-            "refs": refs,
+        return models, missing_metadata
+
+    def process_dbt_models_batched(
+        self, advanced: bool = False, batch_size: int = 10
+    ) -> tuple[list[ModelResult], list[str]]:
+        """Same as process_dbt_models, but requests suggestions for batch_size models at a time"""
+        # Directory order varies between file systems, sorting keeps each batch prompt identical between runs
+        model_files = sorted(find_model_files(self.dbt_project_path))
+        models = []
+
+        for start in range(0, len(model_files), batch_size):
+            batch = []
+            for model_file, model_name in model_files[start : start + batch_size]:
+                batch.append({"model_name": model_name, "sql": self.read_sql(model_file)})
+
+            suggestions = self.suggest_dbt_model_improvements_batch(batch, advanced) if self.api_key_available else {}
+
+            for model in batch:
+                model_suggestions = suggestions.get(model["model_name"])
+                if model_suggestions is None and self.api_key_available:
+                    # The batched reply couldn't be parsed or left this model out, review it on its own instead
+                    model_suggestions = self.get_suggestions(model["sql"], model["model_name"], advanced)
+
+                models.append(
+                    ModelResult(
+                        model["model_name"],
+                        self.model_has_metadata(model["model_name"]),
+                        model_suggestions or "",
+                        self.get_model_refs(model["sql"]),
+                    )
+                )
+
+        missing_metadata = [model.model_name for model in models if not model.metadata_exists]
+
+        return models, missing_metadata
+
+    def process_dbt_models_batch_api(
+        self, advanced: bool = False, poll_interval: int = 30
+    ) -> tuple[list[ModelResult], list[str]]:
+        """Same as process_dbt_models, but submits all suggestion requests as one OpenAI Batch API job"""
+        model_files = sorted(find_model_files(self.dbt_project_path))
+
+        contents = {}
+        for model_file, model_name in model_files:
+            contents[model_name] = self.read_sql(model_file)
+
+        chat_requests = {
+            model_name: build_chat_request(self.build_model_prompt(content, model_name), advanced)
+            for model_name, content in contents.items()
         }
 
-    def process_dbt_models(self, advanced: bool = False):
-        model_files = glob.glob(os.path.join(self.dbt_project_path, "models/**/*.sql"), recursive=True)
-        models = [self.process_model(model_file, advanced) for model_file in model_files]
-        missing_metadata = []
+        suggestions = run_batch(chat_requests, poll_interval) if self.api_key_available else {}
 
-        # Check for models without metadata
-        for model in models:
-            if not model["metadata_exists"]:
-                missing_metadata.append(model["model_name"])
+        models = [
+            ModelResult(
+                model_name,
+                self.model_has_metadata(model_name),
+                suggestions.get(model_name, ""),
+                self.get_model_refs(content),
+            )
+            for model_name, content in contents.items()
+        ]
+        missing_metadata = [model.model_name for model in models if not model.metadata_exists]
 
         return models, missing_metadata
 
-    def model_has_metadata(self, model_name: str) -> bool:
+    def read_documented_models(self) -> frozenset[str]:
+        """Names of all models declared under `models:` in the project's YAML files"""
+        if self.yaml_files and not yaml.__with_libyaml__:
+            print("Warning: PyYAML is installed without libyaml, reading the project's YAML files will be slower.")
+
+        documented_models = set()
         for yaml_file in self.yaml_files:
             with open(yaml_file, "r") as f:
                 try:
-                    yaml_content = yaml.safe_load(f)
-
-                    if yaml_content:
-                        for item in yaml_content.get("models", []):
-                            if isinstance(item, dict) and item.get("name") == model_name:
-                                return True
+                    # Collected per file so a file that fails to parse doesn't contribute any names
+                    documented_models.update(_scan_model_names(f))
                 except yaml.YAMLError as e:
                     print(f"Error parsing YAML file {yaml_file}: {e}")
 
-        return False
+        return frozenset(documented_models)
+
+    def model_has_metadata(self, model_name: str) -> bool:
+        return model_name in self.documented_models
+
+    def generate_lineage_graph(self, models: list[ModelResult]):
+        import networkx as nx
 
-    def generate_lineage_graph(self, models):
         # Create a directed graph
         gph = nx.DiGraph()
 
         # Add nodes for each model
-        for model in models:
-            gph.add_node(model["model_name"], metadata_exists=model["metadata_exists"])
+        gph.add_nodes_from([(model["model_name"], {"metadata_exists": model["metadata_exists"]}) for model in models])
 
         # Add edges based on ref() calls
-        for model in models:
-            refs = model["refs"]
-            for ref in refs:
-                gph.add_edge(ref, model["model_name"])
+        gph.add_edges_from([(ref, model["model_name"]) for model in models for ref in model["refs"]])
 
         return gph
 
+    @staticmethod
+    def lineage_key(gph: nx.DiGraph) -> tuple:
+        return frozenset(gph.nodes()), frozenset(gph.edges())
+
+    def topological_order(self, gph: nx.DiGraph) -> list[str]:
+        import networkx as nx
+
+        key = self.lineage_key(gph)
+        if key not in self._topological_orders:
+            self._topological_orders[key] = list(nx.topological_sort(gph))
+        return self._topological_orders[key]
+
+    def graph_layout(self, gph: nx.DiGraph) -> dict:
+        import networkx as nx
+
+        key = self.lineage_key(gph)
+        if key in self._layouts:
+            return self._layouts[key]
+
+        if nx.is_directed_acyclic_graph(gph):
+            # Lay the models out in columns by their distance from the sources, one pass in topological order
+            layers = {}
+            for node in self.topological_order(gph):
+                layers[node] = max((layers[parent] + 1 for parent in gph.predecessors(node)), default=0)
+            # The layers go on a throwaway graph of the same nodes, rather than into the caller's node attributes
+            layered = nx.Graph()
+            layered.add_nodes_from((node, {"layer": layers[node]}) for node in gph)
+            self._layouts[key] = nx.multipartite_layout(layered, subset_key="layer")
+        else:
+            self._layouts[key] = _spring_layout(gph)
+        return self._layouts[key]
+
     def generate_lineage_description(self, gph: nx.DiGraph) -> str:
-        nodes = list(nx.topological_sort(gph))
+        nodes = self.topological_order(gph)
 
-        description = ""  # "The following DBT models are used:\n\n"
+        lines = []  # "The following DBT models are used:\n\n"
         for node in nodes:
             parents = list(gph.predecessors(node))
             if parents:
                 parent_names = ", ".join(parents)
-                description += f"{node} depends on {parent_names}\n"
+                lines.append(f"{node} depends on {parent_names}\n")
             else:
-                description += f"{node} is a root node\n"
+                lines.append(f"{node} is a root node\n")
+
+        return "".join(lines)
 
-        return description
+    def quick_lineage(self, dbt_models: list[ModelResult]) -> str:
+        """Summary of the lineage from the refs already found in each model, without building the graph"""
+        return f"{len(dbt_models)} models, {sum(len(model['refs']) for model in dbt_models)} edges"
 
-    def generate_lineage(self, dbt_models: list[dict]):
+    def generate_lineage(self, dbt_models: list[ModelResult]):
         gph = self.generate_lineage_graph(dbt_models)
         description = self.generate_lineage_description(gph)
         return description, gph
 
     def generate_image(self, description: str) -> None:
-        image_binary = generate_dalle_image(description)
         image_path = f"{self.dbt_project_path}/lineage.png"
+        # Image generation takes seconds, reuse the image drawn for an identical lineage description
+        cached_path = os.path.join(
+            CACHE_DIR, "images", f"lineage_{hashlib.sha256(description.encode('utf-8')).hexdigest()}.png"
+        )
+        if os.path.exists(cached_path):
+            print(f"Copying previously generated lineage image to {image_path}")
+            shutil.copyfile(cached_path, image_path)
+            return
+
+        image_binary = generate_dalle_image(description)
         print(f"Saving generated lineage image in {image_path}")
         # Write image to file
         with open(image_path, "wb") as f:
             f.write(image_binary)
 
+        tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(image_binary)
+            os.replace(tmp_path, cached_path)
+        except OSError as e:
+            # The image has already been saved to the project, failing to cache it only costs a later regeneration
+            print(f"Warning: could not write to the image cache in {os.path.dirname(cached_path)}: {e}")
+
     def plot_directed_graph(self, gph: nx.DiGraph):
-        pos = nx.spring_layout(gph, seed=42)
+        import numpy as np
+        import plotly.graph_objects as go
+
+        pos = self.graph_layout(gph)
+
+        missing_metadata_color = "rgb(255, 0, 0)"
+
+        # Build the coordinates as plain lists and assign them to the traces once, appending to the
+        # trace tuples copies every previous element on each iteration
+        node_x, node_y, node_text, node_colors = [], [], [], []
+        for node in gph.nodes():
+            x, y = pos[node]
+            node_x.append(x)
+            node_y.append(y)
+
+            # set marker color and/or text label based on whether the model has metadata or not
+            if "metadata_exists" in gph.nodes[node] and not gph.nodes[node]["metadata_exists"]:
+                node_colors.append(missing_metadata_color)
+                node_text.append(f"{node} (MISSING METADATA)")
+            else:
+                node_colors.append("rgb(71, 122, 193)")
+                node_text.append(node)
 
         node_trace = go.Scatter(
-            x=[],
-            y=[],
-            text=[],
+            x=node_x,
+            y=node_y,
+            text=node_text,
             mode="markers+text",
             textposition="top center",
             hoverinfo="text",
-            marker=dict(color="rgb(71, 122, 193)", size=10, line=dict(width=2, color="rgb(0, 0, 0)")),
+            marker=dict(color=node_colors, size=10, line=dict(width=2, color="rgb(0, 0, 0)")),
             name="Nodes",
         )
 
-        missing_metadata_color = "rgb(255, 0, 0)"
+        # Each edge is drawn as x0, x1 followed by a NaN gap, filled in with strided slices
+        edges = list(gph.edges())
+        edge_x = np.full(3 * len(edges), np.nan)
+        edge_y = np.full(3 * len(edges), np.nan)
+        if edges:
+            source_pos = np.array([pos[source] for source, _ in edges])
+            target_pos = np.array([pos[target] for _, target in edges])
+            edge_x[0::3], edge_y[0::3] = source_pos[:, 0], source_pos[:, 1]
+            edge_x[1::3], edge_y[1::3] = target_pos[:, 0], target_pos[:, 1]
 
         edge_trace = go.Scatter(
-            x=[],
-            y=[],
+            x=edge_x,
+            y=edge_y,
             line=dict(width=2, color="#888"),
             hoverinfo="none",
             mode="lines",
             name="Edges",
         )
 
-        for node in gph.nodes():
-            x, y = pos[node]
-            node_trace["x"] += tuple([x])
-            node_trace["y"] += tuple([y])
-            node_trace["text"] += tuple([node])
-
-            # set marker color and/or text label based on whether the model has metadata or not
-            if "metadata_exists" in gph.nodes[node] and not gph.nodes[node]["metadata_exists"]:
-                node_trace["marker"]["color"] = missing_metadata_color
-                node_trace["text"] += tuple(["MISSING METADATA"])
-            else:
-                node_trace["marker"]["color"] = "rgb(71, 122, 193)"
-
-        for edge in gph.edges():
-            x0, y0 = pos[edge[0]]
-            x1, y1 = pos[edge[1]]
-            edge_trace["x"] += tuple([x0, x1, None])
-            edge_trace["y"] += tuple([y0, y1, None])
-
         fig = go.Figure(data=[edge_trace, node_trace])
         fig.update_layout(
             title="Directed Graph of DBT Models",
@@ -219,19 +588,26 @@ class DbtModelProcessor:
         sources_yml = self.sources_yml_content if self.sources_yml_content else ""
         response = generate_models(prompt, sources_yml)
 
-        model_delimiter = "===\n\n"
-        response_lines = response[0].split(model_delimiter)
-
-        for _i, model_str in enumerate(response_lines):
-            if not model_str.strip():
+        model_files = []
+        for model_str in _MODEL_DELIMITER_RE.split(response[0]):
+            model_str = model_str.strip()
+            if not model_str:
                 continue
 
-            model_lines = model_str.strip().split("\n")
-            model_name = model_lines[0].split(":")[-1].strip()
-            model_content = "\n".join(model_lines[1:])
-            model_content = model_content.replace("===", "")
+            # The first line holds "model_name: <name>" and the rest is the model SQL
+            header, _, model_content = model_str.partition("\n")
+            model_name = header.split(":")[-1].strip()
+            model_files.append((os.path.join(self.dbt_project_path, "models", f"{model_name}.sql"), model_content))
+
+        if not model_files:
+            return
+
+        def write_model(model_file: tuple[str, str]) -> str:
+            model_path, model_content = model_file
+            Path(model_path).write_text(model_content.strip())
+            return model_path
 
-            model_path = os.path.join(self.dbt_project_path, "models", f"{model_name}.sql")
-            with open(model_path, "w") as f:
-                f.write(model_content.strip())
-            print(f"Created model file: {model_path}")
+        # Each write blocks on the file system independently, so the files are written concurrently
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(model_files))) as executor:
+            for model_path in executor.map(write_model, model_files):
+                print(f"Created model file: {model_path}")
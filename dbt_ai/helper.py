@@ -1,17 +1,122 @@
 # flake8: noqa
 
-import glob
+import dataclasses
 import html
+import json
 import os
 import re
+import sys
+from typing import Iterator
 
+import yaml
 
-def find_yaml_files(dbt_project_path: str):
-    yaml_files = glob.glob(os.path.join(dbt_project_path, "**/*.yml"), recursive=True)
-    yaml_files.extend(glob.glob(os.path.join(dbt_project_path, "**/*.yaml"), recursive=True))
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup, fall back to the standard library
+    orjson = None
+
+
+def json_loads(data):
+    """Parse JSON with orjson when it is installed. Errors are raised as json.JSONDecodeError either way."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_default(obj):
+    # orjson serializes dataclasses such as ModelResult natively, the standard library needs them as dicts
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 encoded JSON with orjson when it is installed, indented by two spaces if requested"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, indent=2 if indent else None, default=_json_default).encode("utf-8")
+
+
+# Build output, installed packages and virtual environments at the top of the project can hold thousands of
+# files, none of which describe the project's own models
+SKIPPED_DIRECTORIES = frozenset({"target", "dbt_packages", "venv", "node_modules"})
+
+
+def _skipped_paths(dbt_project_path: str) -> set[str]:
+    """Project relative paths find_yaml_files doesn't descend into, including the build and package directories
+    configured in dbt_project.yml"""
+    skipped = set(SKIPPED_DIRECTORIES)
+    try:
+        with open(os.path.join(dbt_project_path, "dbt_project.yml"), "r") as f:
+            config = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError):
+        return skipped
+
+    if isinstance(config, dict):
+        for setting in ("target-path", "packages-install-path"):
+            path = config.get(setting)
+            # Paths set with Jinja, such as env_var(), can't be known without rendering the project
+            if isinstance(path, str) and "{" not in path and not os.path.isabs(path):
+                skipped.add(os.path.normpath(path))
+    return skipped
+
+
+# ref('model') or ref('package', 'model'), the model name is always the last argument
+_REF_RE = re.compile(r"ref\(\s*(?:['\"][\w\.]+['\"]\s*,\s*)?['\"]([\w\.]+)['\"]\s*\)")
+
+
+def extract_refs(sql: str) -> list[str]:
+    """Names of the models referenced with ref() in a model's SQL, found without rendering the Jinja"""
+    # The same few upstream models are referenced all over a project, intern them so each name is stored once
+    return [sys.intern(ref) for ref in _REF_RE.findall(sql)]
+
+
+def find_yaml_files(dbt_project_path: str) -> list[str]:
+    """Paths of all .yml and .yaml files in the project, found in a single walk of the directory tree"""
+    skipped = _skipped_paths(dbt_project_path)
+    yaml_files = []
+    for root, dirs, files in os.walk(dbt_project_path):
+        relative_root = os.path.relpath(root, dbt_project_path)
+        # Like glob, don't descend into hidden directories such as .git or .venv. The skipped paths are relative
+        # to the project, so a model folder that happens to be called target or dbt_packages is still searched
+        dirs[:] = [
+            name
+            for name in dirs
+            if not name.startswith(".") and os.path.normpath(os.path.join(relative_root, name)) not in skipped
+        ]
+        # Hidden files such as .pre-commit-config.yaml are tool configuration rather than dbt properties
+        yaml_files.extend(
+            os.path.join(root, name) for name in files if name.endswith((".yml", ".yaml")) and not name.startswith(".")
+        )
     return yaml_files
 
 
+def find_model_files(dbt_project_path: str) -> Iterator[tuple[str, str]]:
+    """Yield the path and model name of every .sql file under the project's models directory"""
+    stack = [os.path.join(dbt_project_path, "models")]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            # Like glob, a missing or unreadable directory is skipped rather than failing the whole walk
+            continue
+
+        with entries:
+            for entry in entries:
+                # Like glob, hidden files and directories such as .ipynb_checkpoints are not part of the project
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.endswith(".sql"):
+                    yield entry.path, sys.intern(entry.name[:-4])
+
+
+def rename_model(suggestion: str, old_model_name: str, new_model_name: str) -> str:
+    """Point suggestions generated for one model at another model with the same SQL"""
+    return re.sub(rf"\b{re.escape(old_model_name)}\b", new_model_name, suggestion)
+
+
 def format_suggestion(suggestion: str):
     html_suggestion = ""
 
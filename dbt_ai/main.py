@@ -1,8 +1,33 @@
 import argparse
+import contextlib
 import os
+import sys
+from typing import Iterable, TextIO
 
-from dbt_ai.dbt import DbtModelProcessor
-from dbt_ai.report import generate_html_report
+from dbt_ai.dbt import DbtModelProcessor, ModelResult
+from dbt_ai.helper import json_dumps
+
+
+def output_json(data: dict[str, list[ModelResult] | list[str]]) -> None:
+    """Write the full results to stdout as a single indented JSON document"""
+    sys.stdout.write(json_dumps(data, indent=True).decode("utf-8") + "\n")
+
+
+def write_ndjson(models: Iterable[ModelResult], file: TextIO | None = None) -> None:
+    """Write each processed model to stdout (or file) as one JSON object per line, as soon as it is available"""
+    out: TextIO = sys.stdout if file is None else file
+    for model in models:
+        out.write(json_dumps(model).decode("utf-8") + "\n")
+        out.flush()
+
+
+def print_missing_metadata(missing_metadata: list[str]) -> None:
+    if missing_metadata:
+        print("\nThe following models are missing metadata:")
+        for model_name in missing_metadata:
+            print(f"  - {model_name}")
+    else:
+        print("\nAll models have associated metadata.")
 
 
 def main() -> None:
@@ -28,32 +53,97 @@ def main() -> None:
         choices=["snowflake", "postgres", "redshift", "bigquery"],
         default="snowflake",
     )
+    parser.add_argument(
+        "--semantic-cache",
+        action="store_true",
+        help="Reuse suggestions previously generated for near-identical models",
+    )
+    parser.add_argument(
+        "--models-per-request",
+        type=int,
+        default=1,
+        help="Number of dbt models to review in each OpenAI request",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit all requests as one OpenAI batch, which costs half as much but can take up to 24 hours",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print suggestions in the terminal as they are generated",
+    )
+    parser.add_argument(
+        "--quick-lineage",
+        action="store_true",
+        help="Only print a summary of the model lineage instead of describing every dependency",
+    )
+    parser.add_argument(
+        "--metadata-only",
+        action="store_true",
+        help="Only check which models are missing metadata, without reading the models or making OpenAI requests",
+    )
+    parser.add_argument(
+        "--output",
+        choices=["html", "json", "ndjson"],
+        default="html",
+        help="Generate the HTML report, or print the processed models to stdout as JSON or one line of JSON each",
+    )
     args = parser.parse_args()
 
     if not args.create_models:
-        processor = DbtModelProcessor(args.dbt_project_path, args.database)
+        stdout = sys.stdout
+        # Progress messages would mix with machine readable output, send them to stderr instead
+        with contextlib.redirect_stdout(sys.stderr) if args.output != "html" else contextlib.nullcontext():
+            processor = DbtModelProcessor(
+                args.dbt_project_path, args.database, semantic_cache=args.semantic_cache, stream=args.stream
+            )
+
+            if args.metadata_only:
+                models, missing_metadata = processor.process_dbt_models(metadata_only=True)
+            elif args.batch:
+                models, missing_metadata = processor.process_dbt_models_batch_api(advanced=args.advanced_rec)
+            elif args.models_per_request > 1:
+                models, missing_metadata = processor.process_dbt_models_batched(
+                    advanced=args.advanced_rec, batch_size=args.models_per_request
+                )
+            elif args.output == "ndjson":
+                # Print each model as soon as it has been reviewed, rather than holding every result until the end
+                write_ndjson(processor.iter_processed_models(advanced=args.advanced_rec), stdout)
+                return
+            else:
+                models, missing_metadata = processor.process_dbt_models(advanced=args.advanced_rec)
+
+        if args.output == "json":
+            output_json({"models": models, "missing_metadata": missing_metadata})
+            return
+        if args.output == "ndjson":
+            write_ndjson(models)
+            return
 
-        models, missing_metadata = processor.process_dbt_models(advanced=args.advanced_rec)
+        if args.metadata_only:
+            print_missing_metadata(missing_metadata)
+            return
 
         output_path = os.path.join(args.dbt_project_path, "dbt_model_suggestions.html")
 
-        lineage_description, graph = processor.generate_lineage(models)
-        # processor.plot_directed_graph(graph)
+        if args.quick_lineage:
+            print(f"Lineage summary: {processor.quick_lineage(models)}")
+        else:
+            lineage_description, graph = processor.generate_lineage(models)
+            # processor.plot_directed_graph(graph)
+
+            print(f"Lineage description:\n {lineage_description}")
 
-        print(f"Lineage description:\n {lineage_description}")
+        # Jinja and the markdown renderer are only needed once the models have been processed
+        from dbt_ai.report import generate_html_report
 
         generate_html_report(models, output_path, missing_metadata)
         advancedprint = "advanced " if args.advanced_rec else ""
         print(f"Generated {advancedprint}improvement suggestions report at: {output_path}")
 
-        models_without_metadata = [model["model_name"] for model in models if not model["metadata_exists"]]
-
-        if models_without_metadata:
-            print("\nThe following models are missing metadata:")
-            for model_name in models_without_metadata:
-                print(f"  - {model_name}")
-        else:
-            print("\nAll models have associated metadata.")
+        print_missing_metadata(missing_metadata)
     else:
         processor = DbtModelProcessor(args.dbt_project_path, args.database)
         prompt = args.create_models
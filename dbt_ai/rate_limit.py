@@ -0,0 +1,81 @@
+# flake8: noqa
+
+import functools
+import os
+import threading
+import time
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, token counts are estimated without it
+    tiktoken = None
+
+REQUESTS_PER_MINUTE = int(os.getenv("DBT_AI_REQUESTS_PER_MINUTE", "3500"))
+TOKENS_PER_MINUTE = int(os.getenv("DBT_AI_TOKENS_PER_MINUTE", "90000"))
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:  # tiktoken downloads its encodings on first use, which fails offline
+        print(f"Warning: could not load the tiktoken encoding, token counts will be estimated: {e}")
+        return None
+
+
+def count_tokens(messages: list[dict], model: str) -> int:
+    text = "".join(message["content"] for message in messages)
+    encoding = _encoding(model)
+    if encoding is None:
+        # Roughly four characters per token for English text and SQL
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by every thread making OpenAI requests"""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        self._available_requests = min(
+            self.requests_per_minute, self._available_requests + elapsed_minutes * self.requests_per_minute
+        )
+        self._available_tokens = min(
+            self.tokens_per_minute, self._available_tokens + elapsed_minutes * self.tokens_per_minute
+        )
+
+    def acquire(self, tokens: int) -> None:
+        """Block until a request using the given number of tokens fits within both limits"""
+        # A single request larger than the whole budget can never fit, so only wait for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._available_requests >= 1 and self._available_tokens >= tokens:
+                    self._available_requests -= 1
+                    self._available_tokens -= tokens
+                    return
+
+                wait_minutes = max(
+                    (1 - self._available_requests) / self.requests_per_minute,
+                    (tokens - self._available_tokens) / self.tokens_per_minute,
+                )
+            time.sleep(wait_minutes * 60)
+
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
@@ -1,25 +1,55 @@
 # flake8: noqa
 
+import functools
 import os
 import webbrowser
+from importlib.resources import files
 
 import markdown2
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from dbt_ai.cache import CACHE_DIR
+
+try:
+    import cmarkgfm
+    from cmarkgfm.cmark import Options as CmarkOptions
+except ImportError:  # cmarkgfm is an optional speedup, fall back to the pure Python markdown2
+    cmarkgfm = CmarkOptions = None
 
 
 def markdown_filter(value):
+    if cmarkgfm is not None and CmarkOptions is not None:
+        # Raw HTML is passed through unchanged, as markdown2 does by default
+        return cmarkgfm.github_flavored_markdown_to_html(value, options=CmarkOptions.CMARK_OPT_UNSAFE)
     return markdown2.markdown(value, extras=["fenced-code-blocks"])
 
 
-def generate_html_report(models, output_path, missing_metadata: list[str]):
-    template_path = os.path.join(os.path.dirname(__file__), "templates", "report_template.html")
-    env = Environment(loader=FileSystemLoader(os.path.dirname(template_path)))
+@functools.lru_cache(maxsize=None)
+def _environment() -> Environment:
+    # Created on first use, so importing the module doesn't touch the cache directory
+    # Compiled templates are cached on disk, so later runs skip parsing and compiling the report template
+    bytecode_dir = os.path.join(CACHE_DIR, "jinja")
+    try:
+        os.makedirs(bytecode_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+    except OSError:
+        bytecode_cache = None
+
+    env = Environment(
+        loader=FileSystemLoader(str(files("dbt_ai") / "templates")),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+    )
     env.filters["markdown"] = markdown_filter
-    template = env.get_template(os.path.basename(template_path))
+    return env
+
+
+def generate_html_report(models, output_path, missing_metadata: list[str]):
+    template = _environment().get_template("report_template.html")
 
-    rendered_report = template.render(models=models, missing_metadata=missing_metadata)
-    with open(output_path, "w") as f:
-        f.write(rendered_report)
+    # Write the report as it is rendered instead of building the whole document in memory first
+    with open(output_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.writelines(template.generate(models=models, missing_metadata=missing_metadata))
 
     # Open the report in a new browser tab
     webbrowser.open(output_path)
@@ -35,26 +35,43 @@ def dbt_project(tmp_path):
     return tmp_path
 
 
+class Stub:
+    """Records its calls and returns a canned value, much cheaper to build than a MagicMock"""
+
+    def __init__(self, ret=None, side_effect=None):
+        self.ret = ret
+        self.side_effect = side_effect
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        if self.side_effect is not None:
+            return self.side_effect(*args, **kwargs)
+        return self.ret
+
+
 @pytest.fixture
 def mock_generate_response():
-    with patch.object(DbtModelProcessor, "suggest_dbt_model_improvements", autospec=True) as mock_function:
-        mock_function.return_value = ["Use ref() function instead of hardcoding table names."]
-        yield mock_function
+    stub = Stub(["Use ref() function instead of hardcoding table names."])
+    with patch.object(DbtModelProcessor, "suggest_dbt_model_improvements", stub):
+        yield stub
 
 
 @pytest.fixture
 def mock_generate_response_advanced():
-    with patch.object(DbtModelProcessor, "suggest_dbt_model_improvements_advanced") as mock_function:
-        mock_function.return_value = ["Use ref() function instead of hardcoding table names (advanced)."]
-        yield mock_function
+    stub = Stub(["Use ref() function instead of hardcoding table names (advanced)."])
+    with patch.object(DbtModelProcessor, "suggest_dbt_model_improvements_advanced", stub):
+        yield stub
 
 
 @pytest.fixture
 def mock_generate_models():
-    with patch("dbt_ai.dbt.generate_models") as mock:
-        mock.return_value = [
+    stub = Stub(
+        [
             "model_name: model_a\n\nSELECT *\nFROM {{ source('beautiful_source', 'organisation') }}\n",
             "model_name: model_b\n\nSELECT *\nFROM {{ source('beautiful_source', 'user') }}\n",
             "model_name: model_c\n\nSELECT a.industry, SUM(b.total) as total\nFROM {{ ref('model_a') }} a\nJOIN {{ ref('model_b') }} b\nON a.id = b.id\nGROUP BY a.industry",
         ]
-        yield mock
+    )
+    with patch("dbt_ai.dbt.generate_models", stub):
+        yield stub
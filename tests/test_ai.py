@@ -0,0 +1,90 @@
+# flake8: noqa
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from dbt_ai import ai
+from dbt_ai.cache import ResponseCache
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    with patch.object(ai, "response_cache", ResponseCache(str(tmp_path))) as cache:
+        yield cache
+
+
+def stream_chunk(content, finish_reason=None):
+    return SimpleNamespace(choices=[SimpleNamespace(delta={"content": content}, finish_reason=finish_reason)])
+
+
+def completion(content, finish_reason="stop"):
+    return SimpleNamespace(choices=[SimpleNamespace(message={"content": content}, finish_reason=finish_reason)])
+
+
+def test_chat_completion_streams_and_caches(response_cache, capsys):
+    messages = [{"role": "user", "content": "Model name: model1"}]
+    chunks = [stream_chunk("Suggestions for model "), stream_chunk("`model1`"), stream_chunk(" ")]
+
+    with patch("dbt_ai.ai.openai.ChatCompletion.create", return_value=iter(chunks)) as mock_create:
+        assert ai._chat_completion(messages, 0, 100, stream=True) == "Suggestions for model `model1`"
+        assert ai._chat_completion(messages, 0, 100, stream=True) == "Suggestions for model `model1`"
+
+    mock_create.assert_called_once()
+    assert capsys.readouterr().out.count("Suggestions for model `model1`") == 2
+
+
+def test_chat_completion_retries_truncated_responses(response_cache):
+    messages = [{"role": "user", "content": "Model name: model1"}]
+    responses = [completion("Suggestions for", "length"), completion("Suggestions for model `model1`")]
+
+    with patch("dbt_ai.ai.openai.ChatCompletion.create", side_effect=responses) as mock_create:
+        assert ai._chat_completion(messages, 0, 100) == "Suggestions for model `model1`"
+
+    assert [call.kwargs["max_tokens"] for call in mock_create.call_args_list] == [100, 200]
+    assert response_cache.get(ai.chat_cache_key(messages, 0, 100, ai.CHAT_MODEL)) == "Suggestions for model `model1`"
+
+
+def test_chat_completion_does_not_cache_truncated_responses(response_cache, capsys):
+    messages = [{"role": "user", "content": "Model name: model1"}]
+    chunks = [stream_chunk("Suggestions for"), stream_chunk(" model", "length")]
+
+    with patch("dbt_ai.ai.openai.ChatCompletion.create", return_value=iter(chunks)) as mock_create:
+        assert ai._chat_completion(messages, 0, 100, stream=True) == "Suggestions for model"
+
+    mock_create.assert_called_once()
+    assert response_cache.get(ai.chat_cache_key(messages, 0, 100, ai.CHAT_MODEL)) is None
+    assert "was not cached" in capsys.readouterr().out
+
+
+def test_parse_batch_reviews_skips_invalid_reviews():
+    content = """{"reviews": [
+        {"model_name": "model1", "suggestions": ["Use ref() function instead of hardcoding table names."]},
+        {"model_name": "model2", "suggestions": "not a list"},
+        {"suggestions": ["missing model name"]}
+    ]}"""
+
+    assert ai.parse_batch_reviews(content) == {"model1": ["Use ref() function instead of hardcoding table names."]}
+
+
+def test_parse_batch_reviews_rejects_invalid_json():
+    with pytest.raises(ValueError):
+        ai.parse_batch_reviews("Suggestions for model `model1`")
+
+
+def test_call_openai_retries_rate_limited_requests():
+    create = MagicMock(side_effect=[ai.openai.error.RateLimitError("slow down"), "response"])
+
+    with patch("dbt_ai.ai.time.sleep") as mock_sleep:
+        assert ai._call_openai(create, tokens=10) == "response"
+
+    assert create.call_count == 2
+    mock_sleep.assert_called_once()
+
+
+def test_patching_openai_replaces_it_for_requests():
+    with patch("dbt_ai.ai.openai") as mock_openai:
+        assert ai._openai() is mock_openai
+
+    assert ai._openai() is not mock_openai
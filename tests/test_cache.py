@@ -0,0 +1,97 @@
+# flake8: noqa
+
+from unittest.mock import patch
+
+from dbt_ai import cache
+from dbt_ai.cache import ResponseCache, SemanticCache, cached_response
+
+
+def test_response_cache_round_trip(tmp_path):
+    response_cache = ResponseCache(str(tmp_path))
+
+    assert response_cache.get("missing") is None
+
+    response_cache.set("key", "Use ref() function instead of hardcoding table names.")
+    assert response_cache.get("key") == "Use ref() function instead of hardcoding table names."
+
+
+def test_response_cache_expires_entries(tmp_path):
+    response_cache = ResponseCache(str(tmp_path), ttl=0)
+    response_cache.set("key", "stale")
+
+    with patch("dbt_ai.cache.time.time", return_value=10**12):
+        assert response_cache.get("key") is None
+
+
+def test_cached_response_only_calls_once_per_arguments(tmp_path):
+    calls = []
+
+    @cached_response
+    def fake_completion(prompt, temperature=0):
+        calls.append(prompt)
+        return f"suggestions for {prompt}"
+
+    with patch.object(cache, "response_cache", ResponseCache(str(tmp_path))):
+        assert fake_completion("model1") == "suggestions for model1"
+        assert fake_completion("model1") == "suggestions for model1"
+        assert fake_completion("model1", temperature=0.5) == "suggestions for model1"
+        assert fake_completion("model2") == "suggestions for model2"
+
+    assert calls == ["model1", "model1", "model2"]
+
+
+def test_semantic_cache_matches_similar_embeddings(tmp_path):
+    semantic_cache = SemanticCache(str(tmp_path / "semantic.jsonl"), threshold=0.95)
+
+    assert semantic_cache.lookup([1.0, 0.0, 0.0]) is None
+
+    semantic_cache.add([1.0, 0.0, 0.0], "model1", "Suggestions for model `model1`")
+
+    match = SemanticCache(str(tmp_path / "semantic.jsonl")).lookup([0.99, 0.05, 0.0])
+    assert match["model_name"] == "model1"
+    assert semantic_cache.lookup([0.0, 1.0, 0.0]) is None
+
+
+def test_response_cache_treats_corrupt_entries_as_misses(tmp_path):
+    response_cache = ResponseCache(str(tmp_path))
+    (tmp_path / "invalid.json").write_text("{not json")
+    (tmp_path / "wrong_shape.json").write_text('["created", "value"]')
+    (tmp_path / "missing_fields.json").write_text('{"value": "stale"}')
+
+    assert response_cache.get("invalid") is None
+    assert response_cache.get("wrong_shape") is None
+    assert response_cache.get("missing_fields") is None
+
+
+def test_response_cache_ignores_unusable_directory(tmp_path, capsys):
+    (tmp_path / "file").write_text("")
+    response_cache = ResponseCache(str(tmp_path / "file" / "cache"))
+
+    response_cache.set("key", "value")
+
+    assert response_cache.get("key") is None
+    assert "could not write to the response cache" in capsys.readouterr().out
+
+
+def test_semantic_cache_appends_entries_and_skips_expired_ones(tmp_path):
+    path = tmp_path / "semantic.jsonl"
+    semantic_cache = SemanticCache(str(path))
+    semantic_cache.add([1.0, 0.0, 0.0], "model1", "Suggestions for model `model1`")
+    semantic_cache.add([0.0, 1.0, 0.0], "model2", "Suggestions for model `model2`")
+    with open(path, "a") as f:
+        f.write('{"created": 0, "embedding": [0.0, 0.0, 1.0], "model_name": "model3", "response": ""}\n{"trunc')
+
+    assert len(path.read_text().splitlines()) == 4
+    reloaded = SemanticCache(str(path))
+    assert reloaded.lookup([0.0, 1.0, 0.0])["model_name"] == "model2"
+    assert reloaded.lookup([0.0, 0.0, 1.0]) is None
+
+
+def test_semantic_cache_ignores_unusable_directory(tmp_path, capsys):
+    (tmp_path / "file").write_text("")
+    semantic_cache = SemanticCache(str(tmp_path / "file" / "semantic.jsonl"))
+
+    semantic_cache.add([1.0, 0.0, 0.0], "model1", "Suggestions for model `model1`")
+
+    assert semantic_cache.lookup([1.0, 0.0, 0.0])["model_name"] == "model1"
+    assert "could not write to the semantic cache" in capsys.readouterr().out
@@ -1,16 +1,16 @@
 # flake8: noqa
 
 import os
+import time
 from unittest.mock import mock_open, patch, call
 from unittest import mock
-from dbt_ai.dbt import DbtModelProcessor  #
+from dbt_ai.dbt import DbtModelProcessor
+from tests.fixtures import Stub
 
 
 def test_suggest_dbt_model_improvements(mock_generate_response, dbt_project):
     processor = DbtModelProcessor(dbt_project)
-    model_file = os.path.join(dbt_project, "models", "model1.sql")
-
-    suggestions = processor.suggest_dbt_model_improvements(model_file, "model1")
+    suggestions = processor.suggest_dbt_model_improvements("SELECT * FROM table1;", "model1")
 
     assert len(suggestions) > 0
     assert suggestions[0] == "Use ref() function instead of hardcoding table names."
@@ -43,9 +43,7 @@ def test_process_dbt_models(mock_generate_response, mock_generate_response_advan
 
 def test_suggest_dbt_model_improvements_advanced(mock_generate_response, mock_generate_response_advanced, dbt_project):
     processor = DbtModelProcessor(dbt_project)
-    model_file = os.path.join(dbt_project, "models", "model1.sql")
-
-    suggestions = processor.suggest_dbt_model_improvements_advanced(model_file, "model1")
+    suggestions = processor.suggest_dbt_model_improvements_advanced("SELECT * FROM table1;", "model1")
 
     assert len(suggestions) > 0
     assert suggestions[0] == "Use ref() function instead of hardcoding table names (advanced)."
@@ -83,10 +81,257 @@ def test_model_has_metadata(dbt_project):
     assert not processor.model_has_metadata("model3")
 
 
+def test_model_has_metadata_ignores_other_names(dbt_project):
+    (dbt_project / "models" / "properties.yml").write_text(
+        """
+sources:
+  - name: source1
+    tables:
+      - name: table1
+models:
+  - name: model3
+    columns:
+      - name: id
+    meta: {name: not_a_model}
+"""
+    )
+    processor = DbtModelProcessor(dbt_project)
+
+    assert processor.model_has_metadata("model3")
+    assert not processor.model_has_metadata("source1")
+    assert not processor.model_has_metadata("table1")
+    assert not processor.model_has_metadata("id")
+    assert not processor.model_has_metadata("not_a_model")
+
+
 def test_create_dbt_models(dbt_project, mock_generate_models):
     processor = DbtModelProcessor(dbt_project)
 
     prompt = "prompt for creating dbt models"
     processor.create_dbt_models(prompt)
 
-    assert mock_generate_models.called_once_with(prompt, mock.ANY)
+    assert len(mock_generate_models.calls) == 1
+    assert mock_generate_models.calls[0][0][0] == prompt
+
+
+def test_process_dbt_models_batched(dbt_project, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    processor = DbtModelProcessor(dbt_project)
+
+    mock_batch = Stub({"model1": "Use ref() function instead of hardcoding table names."})
+    with patch("dbt_ai.dbt.generate_response_batch", mock_batch):
+        models, missing_metadata = processor.process_dbt_models_batched(advanced=False, batch_size=10)
+
+    assert mock_batch.calls == [(([{"model_name": "model1", "sql": "SELECT * FROM table1;"}], "snowflake", False), {})]
+    assert len(models) == 1
+    assert models[0]["model_name"] == "model1"
+    assert models[0]["suggestions"] == "Use ref() function instead of hardcoding table names."
+    assert missing_metadata == []
+
+
+def test_process_dbt_models_batched_falls_back_to_single_requests(mock_generate_response, dbt_project, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    processor = DbtModelProcessor(dbt_project)
+
+    with patch("dbt_ai.dbt.generate_response_batch", Stub({})):
+        models, _ = processor.process_dbt_models_batched(advanced=False, batch_size=10)
+
+    assert len(mock_generate_response.calls) == 1
+    assert models[0]["suggestions"] == ["Use ref() function instead of hardcoding table names."]
+
+
+def test_process_dbt_models_batch_api(dbt_project, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    processor = DbtModelProcessor(dbt_project)
+
+    mock_run_batch = Stub({"model1": "Use ref() function instead of hardcoding table names."})
+    with patch("dbt_ai.dbt.run_batch", mock_run_batch):
+        models, missing_metadata = processor.process_dbt_models_batch_api(advanced=True)
+
+    chat_requests = mock_run_batch.calls[0][0][0]
+    assert list(chat_requests) == ["model1"]
+    assert "SELECT * FROM table1;" in chat_requests["model1"]["messages"][-1]["content"]
+    assert models[0]["suggestions"] == "Use ref() function instead of hardcoding table names."
+    assert missing_metadata == []
+
+
+def test_create_dbt_models_writes_each_model(dbt_project):
+    processor = DbtModelProcessor(dbt_project)
+    response = "model_name: model_a\n\nSELECT *\nFROM {{ source('beautiful_source', 'organisation') }}\n===\n\nmodel_name: model_b\nSELECT 1\n===\n"
+
+    with patch("dbt_ai.dbt.generate_models", return_value=[response]):
+        processor.create_dbt_models("prompt for creating dbt models")
+
+    models_path = dbt_project / "models"
+    assert (
+        models_path / "model_a.sql"
+    ).read_text() == "SELECT *\nFROM {{ source('beautiful_source', 'organisation') }}"
+    assert (models_path / "model_b.sql").read_text() == "SELECT 1"
+
+
+def test_process_dbt_models_reuses_suggestions_for_identical_sql(mock_generate_response, dbt_project, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    (dbt_project / "models" / "model1_copy.sql").write_text("SELECT * FROM table1;")
+    mock_generate_response.side_effect = lambda content, model_name: (
+        f"Suggestions for model `{model_name}`:\n\n- Use ref()"
+    )
+    processor = DbtModelProcessor(dbt_project)
+
+    models, _ = processor.process_dbt_models(advanced=False)
+
+    assert len(mock_generate_response.calls) == 1
+    suggestions = {model["model_name"]: model["suggestions"] for model in models}
+    assert suggestions["model1"] == "Suggestions for model `model1`:\n\n- Use ref()"
+    assert suggestions["model1_copy"] == "Suggestions for model `model1_copy`:\n\n- Use ref()"
+
+
+def test_get_model_refs_allows_whitespace(dbt_project):
+    processor = DbtModelProcessor(dbt_project)
+
+    refs = processor.get_model_refs("SELECT * FROM {{ ref('model1') }} JOIN {{ ref( \"model2\" ) }}")
+
+    assert refs == ["model1", "model2"]
+
+
+def test_generate_lineage_description_reuses_topological_order(dbt_project):
+    processor = DbtModelProcessor(dbt_project)
+    models = [
+        {"model_name": "model1", "metadata_exists": True, "refs": []},
+        {"model_name": "model2", "metadata_exists": False, "refs": ["model1"]},
+    ]
+
+    with patch("networkx.topological_sort", return_value=iter(["model1", "model2"])) as mock_sort:
+        description, gph = processor.generate_lineage(models)
+        assert processor.generate_lineage_description(gph) == description
+
+    mock_sort.assert_called_once()
+    assert description == "model1 is a root node\nmodel2 depends on model1\n"
+
+
+def test_graph_layout_leaves_node_attributes_alone(dbt_project):
+    processor = DbtModelProcessor(dbt_project)
+    gph = processor.generate_lineage_graph(
+        [
+            {"model_name": "model1", "metadata_exists": True, "refs": []},
+            {"model_name": "model2", "metadata_exists": False, "refs": ["model1"]},
+        ]
+    )
+    gph.nodes["model2"]["layer"] = "marts"
+
+    pos = processor.graph_layout(gph)
+
+    assert pos["model1"][0] < pos["model2"][0]
+    assert dict(gph.nodes(data=True)) == {
+        "model1": {"metadata_exists": True},
+        "model2": {"metadata_exists": False, "layer": "marts"},
+    }
+
+
+def test_graph_layout_handles_cycles(dbt_project):
+    processor = DbtModelProcessor(dbt_project)
+    models = [
+        {"model_name": "model1", "metadata_exists": True, "refs": ["model2"]},
+        {"model_name": "model2", "metadata_exists": True, "refs": ["model1"]},
+        {"model_name": "model3", "metadata_exists": True, "refs": []},
+    ]
+
+    pos = processor.graph_layout(processor.generate_lineage_graph(models))
+
+    assert set(pos) == {"model1", "model2", "model3"}
+    assert all(abs(coordinate) <= 1 for xy in pos.values() for coordinate in xy)
+
+
+def test_generate_image_reuses_cached_image(dbt_project, tmp_path):
+    processor = DbtModelProcessor(dbt_project)
+
+    with patch("dbt_ai.dbt.CACHE_DIR", str(tmp_path / "cache")), patch(
+        "dbt_ai.dbt.generate_dalle_image", return_value=b"png"
+    ) as mock_dalle:
+        processor.generate_image("model1 is a root node\n")
+        (dbt_project / "lineage.png").unlink()
+        processor.generate_image("model1 is a root node\n")
+
+    mock_dalle.assert_called_once()
+    assert (dbt_project / "lineage.png").read_bytes() == b"png"
+
+
+def test_generate_image_warns_when_the_cache_is_unusable(dbt_project, tmp_path, capsys):
+    processor = DbtModelProcessor(dbt_project)
+    cache_dir = tmp_path / "cache"
+    cache_dir.write_text("not a directory")
+
+    with patch("dbt_ai.dbt.CACHE_DIR", str(cache_dir)), patch("dbt_ai.dbt.generate_dalle_image", return_value=b"png"):
+        processor.generate_image("model1 is a root node\n")
+
+    assert (dbt_project / "lineage.png").read_bytes() == b"png"
+    assert "Warning: could not write to the image cache" in capsys.readouterr().out
+
+
+def test_quick_lineage(dbt_project):
+    processor = DbtModelProcessor(dbt_project)
+    models = [
+        {"model_name": "model1", "metadata_exists": True, "refs": []},
+        {"model_name": "model2", "metadata_exists": True, "refs": ["model1"]},
+        {"model_name": "model3", "metadata_exists": True, "refs": ["model1", "model2"]},
+    ]
+
+    assert processor.quick_lineage(models) == "3 models, 3 edges"
+
+
+def test_iter_processed_models_yields_each_model(mock_generate_response, dbt_project):
+    processor = DbtModelProcessor(dbt_project)
+
+    models = processor.iter_processed_models(advanced=False)
+
+    assert not isinstance(models, list)
+    assert [model["model_name"] for model in models] == ["model1"]
+
+
+def test_iter_processed_models_stops_reviewing_when_closed(mock_generate_response, dbt_project):
+    for index in range(2, 11):
+        (dbt_project / "models" / f"model{index}.sql").write_text(f"SELECT {index};")
+    # Slow enough that the queued reviews are still waiting when the generator is closed
+    mock_generate_response.side_effect = lambda content, model_name: time.sleep(0.05) or ["Use ref()"]
+    processor = DbtModelProcessor(dbt_project)
+
+    models = processor.iter_processed_models(advanced=False, max_workers=1)
+    next(models)
+    models.close()
+
+    # The review running when the generator was closed still finishes, none of the queued ones start
+    assert len(mock_generate_response.calls) <= 2
+
+
+def test_process_dbt_models_scans_metadata_once(mock_generate_response, dbt_project):
+    (dbt_project / "models" / "model2.sql").write_text("SELECT * FROM table2;")
+    processor = DbtModelProcessor(dbt_project)
+    scan = Stub(frozenset({"model1"}))
+
+    with patch.object(processor, "read_documented_models", scan):
+        _, missing_metadata = processor.process_dbt_models(advanced=False)
+
+    assert len(scan.calls) == 1
+    assert missing_metadata == ["model2"]
+
+
+def test_process_dbt_models_metadata_only(mock_generate_response, dbt_project):
+    (dbt_project / "models" / "model3.sql").write_text("SELECT * FROM {{ ref('model1') }}")
+    processor = DbtModelProcessor(dbt_project)
+
+    with patch.object(processor, "read_sql", Stub()) as read_sql:
+        models, missing_metadata = processor.process_dbt_models(metadata_only=True)
+
+    assert read_sql.calls == []
+    assert mock_generate_response.calls == []
+    assert sorted(model["model_name"] for model in models) == ["model1", "model3"]
+    assert all(model["suggestions"] == "" and model["refs"] == [] for model in models)
+    assert missing_metadata == ["model3"]
+
+
+def test_model_has_metadata_ignores_invalid_yaml_files(dbt_project, capsys):
+    (dbt_project / "models" / "broken.yml").write_text("models:\n  - name: model3\n    description: Note: see docs\n")
+    processor = DbtModelProcessor(dbt_project)
+
+    assert not processor.model_has_metadata("model3")
+    assert processor.model_has_metadata("model1")
+    assert "Error parsing YAML file" in capsys.readouterr().out
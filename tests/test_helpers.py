@@ -3,7 +3,7 @@
 import os
 
 from dbt_ai.dbt import DbtModelProcessor  #
-from dbt_ai.helper import find_yaml_files
+from dbt_ai.helper import extract_refs, find_model_files, find_yaml_files
 
 
 def test_find_yaml_files(dbt_project):
@@ -12,3 +12,85 @@ def test_find_yaml_files(dbt_project):
 
     assert len(yaml_files) >= 1
     assert os.path.basename(yaml_files[0]) == "schema.yml"
+
+
+def test_find_yaml_files_skips_build_and_package_directories(dbt_project):
+    for directory in ("target", "dbt_packages", ".venv"):
+        (dbt_project / directory).mkdir()
+        (dbt_project / directory / "schema.yml").write_text("models: []")
+
+    yaml_files = find_yaml_files(str(dbt_project))
+
+    assert sorted(os.path.relpath(path, dbt_project) for path in yaml_files) == [
+        os.path.join("models", "sources.yml"),
+        "schema.yml",
+    ]
+
+
+def test_find_yaml_files_skips_hidden_files(dbt_project):
+    (dbt_project / ".pre-commit-config.yaml").write_text("repos: []")
+    (dbt_project / "models" / ".sqlfluff.yml").write_text("templater: dbt")
+
+    yaml_files = find_yaml_files(str(dbt_project))
+
+    assert sorted(os.path.relpath(path, dbt_project) for path in yaml_files) == [
+        os.path.join("models", "sources.yml"),
+        "schema.yml",
+    ]
+
+
+def test_find_yaml_files_searches_model_folders_with_skipped_names(dbt_project):
+    for directory in ("target", "dbt_packages"):
+        (dbt_project / "models" / directory).mkdir()
+        (dbt_project / "models" / directory / "schema.yml").write_text("models: []")
+
+    yaml_files = find_yaml_files(str(dbt_project))
+
+    assert os.path.join(dbt_project, "models", "dbt_packages", "schema.yml") in yaml_files
+    assert os.path.join(dbt_project, "models", "target", "schema.yml") in yaml_files
+
+
+def test_find_yaml_files_skips_configured_target_path(dbt_project):
+    (dbt_project / "dbt_project.yml").write_text("name: project\ntarget-path: build/output\n")
+    (dbt_project / "build" / "output").mkdir(parents=True)
+    (dbt_project / "build" / "output" / "manifest.yml").write_text("models: []")
+    (dbt_project / "build" / "schema.yml").write_text("models: []")
+
+    yaml_files = find_yaml_files(str(dbt_project))
+
+    assert os.path.join(dbt_project, "build", "schema.yml") in yaml_files
+    assert os.path.join(dbt_project, "build", "output", "manifest.yml") not in yaml_files
+
+
+def test_find_model_files(dbt_project):
+    nested_path = dbt_project / "models" / "staging"
+    nested_path.mkdir()
+    (nested_path / "stg_model.sql").write_text("SELECT 1")
+    (nested_path / "notes.md").write_text("not a model")
+
+    model_files = sorted(find_model_files(str(dbt_project)))
+
+    assert model_files == [
+        (os.path.join(dbt_project, "models", "model1.sql"), "model1"),
+        (os.path.join(nested_path, "stg_model.sql"), "stg_model"),
+    ]
+
+
+def test_find_model_files_skips_hidden_files_and_directories(dbt_project):
+    checkpoints_path = dbt_project / "models" / ".ipynb_checkpoints"
+    checkpoints_path.mkdir()
+    (checkpoints_path / "model1-checkpoint.sql").write_text("SELECT 1")
+    (dbt_project / "models" / ".model2.sql").write_text("SELECT 1")
+
+    assert [model_name for _, model_name in find_model_files(str(dbt_project))] == ["model1"]
+
+
+def test_find_model_files_without_models_directory(tmp_path):
+    assert list(find_model_files(str(tmp_path))) == []
+
+
+def test_extract_refs():
+    sql = "SELECT * FROM {{ ref('model1') }} JOIN {{ ref('my_package', 'model2') }} USING (id)"
+
+    assert extract_refs(sql) == ["model1", "model2"]
+    assert extract_refs("") == []
@@ -0,0 +1,40 @@
+# flake8: noqa
+
+import json
+
+from dbt_ai.dbt import ModelResult
+from dbt_ai.main import output_json, write_ndjson
+
+
+def test_write_ndjson(capsys):
+    models = [
+        {"model_name": "model1", "metadata_exists": True, "suggestions": "", "refs": []},
+        {"model_name": "model2", "metadata_exists": False, "suggestions": "", "refs": ["model1"]},
+    ]
+
+    write_ndjson(models)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line) for line in lines] == models
+
+
+def test_output_json(capsys):
+    data = {
+        "models": [{"model_name": "model1", "metadata_exists": False, "suggestions": "", "refs": []}],
+        "missing_metadata": ["model1"],
+    }
+
+    output_json(data)
+
+    assert json.loads(capsys.readouterr().out) == data
+
+
+def test_write_ndjson_serializes_model_results(capsys):
+    write_ndjson([ModelResult("model1", True, "Use ref()", ["model2"])])
+
+    assert json.loads(capsys.readouterr().out) == {
+        "model_name": "model1",
+        "metadata_exists": True,
+        "suggestions": "Use ref()",
+        "refs": ["model2"],
+    }
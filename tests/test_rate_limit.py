@@ -0,0 +1,36 @@
+# flake8: noqa
+
+from unittest.mock import patch
+
+from dbt_ai.rate_limit import RateLimiter, count_tokens
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter_waits_for_token_budget():
+    clock = FakeClock()
+
+    with patch("dbt_ai.rate_limit.time", clock):
+        rate_limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=1000)
+        rate_limiter.acquire(800)
+        assert clock.sleeps == []
+
+        rate_limiter.acquire(500)
+
+    # 300 tokens were missing, which takes 18 seconds to refill at 1000 tokens per minute
+    assert [round(seconds) for seconds in clock.sleeps] == [18]
+
+
+def test_count_tokens_is_positive():
+    assert count_tokens([{"content": "SELECT * FROM table1;"}], "gpt-3.5-turbo") > 0
@@ -0,0 +1,25 @@
+# flake8: noqa
+
+from unittest.mock import patch
+
+from dbt_ai.report import generate_html_report
+
+
+def test_generate_html_report(tmp_path):
+    models = [
+        {
+            "model_name": "model1",
+            "metadata_exists": False,
+            "suggestions": "Suggestions for model `model1`:\n\n- Use ref() function instead of hardcoding table names.",
+            "refs": [],
+        }
+    ]
+    output_path = tmp_path / "dbt_model_suggestions.html"
+
+    with patch("dbt_ai.report.webbrowser.open") as mock_open:
+        generate_html_report(models, str(output_path), ["model1"])
+
+    report = output_path.read_text()
+    assert "model1" in report
+    assert "<li>Use ref() function instead of hardcoding table names.</li>" in report
+    mock_open.assert_called_once_with(str(output_path))